@@ -1,14 +1,21 @@
 import json
 import re
 import os
-import urllib.request
 import glob
+import hashlib
+import multiprocessing
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import requests
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from github import Github
 import sys
 
 from validation_functions import *
 
-pat = re.compile(r"submissions/.*/(.+)/\d\d\d\d-\d\d-\d\d-.*\1.csv")
+pat = re.compile(r"submissions/.*/(.+)/\d{4}-\d{2}-\d{2}-.*\1\.csv")
 
 token  = os.environ.get('GH_TOKEN')
 # print("Added token")
@@ -21,27 +28,78 @@ repo = g.get_repo(repo_name)
 print(f"Github repository: {repo_name}")
 print(f"Github event name: {os.environ.get('GITHUB_EVENT_NAME')}")
 
-event = json.load(open(os.environ.get('GITHUB_EVENT_PATH')))
-
 pr = None
 comment = ''
 files_changed = []
 
-# Fetch the  PR number from the event json
-pr_num = event['pull_request']['number']
+# Fetch the PR number from the event json; only this field is needed, so the
+# parsed event payload is not kept around
+with open(os.environ.get('GITHUB_EVENT_PATH')) as fp:
+    pr_num = json.load(fp)['pull_request']['number']
 print(f"PR number: {pr_num}")
 
-# Use the Github API to fetch the Pullrequest Object. Refer to details here: https://pygithub.readthedocs.io/en/latest/github_objects/PullRequest.html 
+# Use the Github API to fetch the Pullrequest Object. Refer to details here: https://pygithub.readthedocs.io/en/latest/github_objects/PullRequest.html
 # pr is the Pullrequest object
 pr = repo.get_pull(pr_num)
 
+# Lightweight replacement for the PyGithub File objects, holding only the fields used below.
+PRFile = namedtuple('PRFile', ['filename', 'status', 'raw_url'])
+
+# REST-style status names for the changeType values returned by GraphQL
+CHANGE_TYPES = {'ADDED': 'added', 'DELETED': 'removed', 'MODIFIED': 'modified',
+                'RENAMED': 'renamed', 'COPIED': 'copied', 'CHANGED': 'changed'}
+
+def gql_get_pr_files(pr_num):
+    # Fetch the files changed in the PR via GraphQL in pages of 100, instead of
+    # PyGithub's REST pagination which issues one round-trip per 30 files and
+    # returns far more fields than we use.
+    owner, name = repo_name.split('/')
+    query = """
+    query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+      repository(owner: $owner, name: $name) {
+        pullRequest(number: $number) {
+          files(first: 100, after: $cursor) {
+            nodes { path changeType }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+      }
+    }
+    """
+    files = []
+    cursor = None
+    while True:
+        r = requests.post("https://api.github.com/graphql",
+                          json={"query": query, "variables": {"owner": owner, "name": name,
+                                                              "number": pr_num, "cursor": cursor}},
+                          headers={"Authorization": f"bearer {token}"})
+        r.raise_for_status()
+        payload = r.json()
+        # GraphQL reports auth failures and bad queries as 200 with an "errors" array
+        if payload.get("errors"):
+            raise RuntimeError(f"GraphQL query for PR files failed: {payload['errors']}")
+        pull_request = payload["data"]["repository"]["pullRequest"]
+        if pull_request is None:
+            raise RuntimeError(f"PR #{pr_num} not found in {repo_name}.")
+        result = pull_request["files"]
+        for node in result["nodes"]:
+            files.append(PRFile(filename=node["path"],
+                                status=CHANGE_TYPES.get(node["changeType"], node["changeType"].lower()),
+                                raw_url=f"https://raw.githubusercontent.com/{repo_name}/{pr.head.sha}/{node['path']}"))
+        if not result["pageInfo"]["hasNextPage"]:
+            break
+        cursor = result["pageInfo"]["endCursor"]
+    return files
+
 # fetch all files changed in this PR and add it to the files_changed list.
-files_changed += [f for f in pr.get_files()]
+files_changed += gql_get_pr_files(pr_num)
     
 # Split all files in `files_changed` list into valid forecasts and other files
-forecasts = [file for file in files_changed if pat.match(file.filename) is not None]
+# (single pass, one regex match per file)
+forecasts, other_files = [], []
+for file in files_changed:
+    (forecasts if pat.fullmatch(file.filename) else other_files).append(file)
 print(forecasts)
-other_files = [file for file in files_changed if file not in forecasts]
 
 
 # IF there are other fiels changed in the PR 
@@ -81,24 +139,104 @@ if changed_forecasts:
 # create a forecasts directory
 os.makedirs('forecasts', exist_ok=True)
 
-# Download all forecasts changed in the PR into the forecasts folder that have not been deleted
-for f in forecasts:
-    if f.status != "removed":
-        # create subdirectory
-        os.makedirs('forecasts/' + f.filename.rsplit('/', 1)[0], exist_ok=True)   
-        urllib.request.urlretrieve(f.raw_url, f"forecasts/{f.filename}")
+# Use a shared session so all downloads reuse the same TLS connections (keep-alive)
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+ETAG_FILE = os.path.expanduser('~/.cache/respinow_validate/etags.json')
+
+# ETags from previous workflow runs (restored via actions/cache together with the
+# forecasts directory) allow conditional GETs that skip unchanged payloads
+try:
+    with open(ETAG_FILE) as fp:
+        etags = json.load(fp)
+except (FileNotFoundError, json.JSONDecodeError):
+    etags = {}
+
+def download_forecast(f):
+    dest = f"forecasts/{f.filename}"
+    # create subdirectory
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    headers = {}
+    if f.raw_url in etags and os.path.exists(dest):
+        headers['If-None-Match'] = etags[f.raw_url]
+    # stream straight to disk in 64 KiB chunks instead of buffering the whole body
+    with session.get(f.raw_url, stream=True, headers=headers) as r:
+        if r.status_code == 304:
+            # unchanged since the last run, keep the cached copy
+            return
+        r.raise_for_status()
+        with open(dest, 'wb') as out:
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                out.write(chunk)
+        if 'ETag' in r.headers:
+            etags[f.raw_url] = r.headers['ETag']
+
+# Download all forecasts changed in the PR into the forecasts folder that have not been deleted.
+# Downloads run in parallel as they are network-bound; max_workers is capped to stay
+# well below GitHub's secondary rate limits.
+with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(download_forecast, [f for f in forecasts if f.status != "removed"]))
+
+os.makedirs(os.path.dirname(ETAG_FILE), exist_ok=True)
+with open(ETAG_FILE, 'w') as fp:
+    json.dump(etags, fp)
     
 # Run validations on each file that matches the naming convention
 all_errors = {}
 
+CACHE_FILE = os.path.expanduser('~/.cache/respinow_validate/results.json')
+
+def file_digest(path):
+    with open(path, 'rb') as fp:
+        return hashlib.blake2b(fp.read(), digest_size=16).hexdigest()
+
+def cache_key(path):
+    # check_forecast is not a pure function of the file's bytes: check_filepath and
+    # the filename-vs-column comparison depend on the path, and the "forecast is not
+    # made today" check depends on the current date, so both go into the key
+    today = datetime.now(ZoneInfo('Europe/Berlin')).date()
+    return f"{file_digest(path)}:{path}:{today}"
+
+# Results are memoized per content hash, path and day, so re-runs on the same PR
+# (cache restored via actions/cache) only re-validate files that actually changed.
+try:
+    with open(CACHE_FILE) as fp:
+        cache = json.load(fp)
+except (FileNotFoundError, json.JSONDecodeError):
+    cache = {}
+
 print("Check files:")
-for file in glob.glob("forecasts/**/*.csv", recursive=True):
+files = glob.glob("forecasts/**/*.csv", recursive=True)
+cache_keys = {file: cache_key(file) for file in files}
+to_check = [file for file in files if cache_keys[file] not in cache]
+results = {file: cache[cache_keys[file]] for file in files if cache_keys[file] in cache}
+
+# each file is validated independently, so run them across cores; processes
+# sidestep the GIL for the CPU-bound pandas work. The fork context is pinned
+# because this script runs code at module level: spawned workers would
+# re-execute it (GitHub API calls included) and break the pool.
+with ProcessPoolExecutor(mp_context=multiprocessing.get_context("fork")) as executor:
+    futures = {file: executor.submit(check_forecast, file) for file in to_check}
+    for file, future in futures.items():
+        exception = future.exception()
+        if exception is not None:
+            # one broken file must not kill the whole batch; report the failure for
+            # this run only, so the next run retries instead of hitting the cache
+            results[file] = [f"Fatal error: validation raised {type(exception).__name__}: {exception}"]
+        else:
+            results[file] = cache[cache_keys[file]] = future.result()
+
+for file in files:
     print(file)
-    errors = check_forecast(file)
-    print("Done.")
+    errors = results[file]
     if len(errors) > 0:
         all_errors[os.path.basename(file)] = errors
 
+os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+with open(CACHE_FILE, 'w') as fp:
+    json.dump(cache, fp)
+
 
 # look for .csv files that dont match pat regex
 for file in other_files:
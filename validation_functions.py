@@ -3,7 +3,7 @@ import re
 import pandas as pd
 import numpy as np
 
-SUBMISSION_PATTERN = re.compile(r"forecasts/submissions.*/(.+)/(.+)/(.+)/\d\d\d\d-\d\d-\d\d-\1-\2-\3.csv")
+SUBMISSION_PATTERN = re.compile(r"forecasts/submissions.*/(.+)/(.+)/(.+)/\d{4}-\d{2}-\d{2}-\1-\2-\3\.csv")
 
 VALID_COLUMNS = ['location', 'age_group', 'forecast_date', 'target_end_date', 'horizon', 
                  'type', 'quantile', 'value']
@@ -16,23 +16,39 @@ VALID_TYPES = ['mean', 'quantile']
 VALID_AGE_GROUPS = ['00+', '00-04', '05-14', '15-34', '35-59', '60-79', '80+', '60+']
 VALID_HORIZONS = [-3, -2, -1, 0, 1, 2, 3, 4]
 
+# frozensets of the above for O(1) membership tests; the lists keep a stable
+# ordering for error messages
+_VALID_COLUMN_SET = frozenset(VALID_COLUMNS)
+_LOCATION_SET = frozenset(LOCATION_CODES)
+_QUANTILE_SET = frozenset(VALID_QUANTILES)
+_TYPE_SET = frozenset(VALID_TYPES)
+_AGE_GROUP_SET = frozenset(VALID_AGE_GROUPS)
+_HORIZON_SET = frozenset(VALID_HORIZONS)
+
+def _preview(frame, max_rows = 20, **to_string_kwargs):
+    # cap the rendered error output at max_rows so huge invalid files neither spend
+    # CPU in the pandas formatter nor exceed GitHub's 65 KB comment body limit
+    preview = frame.head(max_rows).to_string(**to_string_kwargs)
+    if len(frame) > max_rows:
+        preview += f"\n... ({len(frame) - max_rows} more rows hidden)"
+    return preview
+
 def check_filepath(filepath):
-    if SUBMISSION_PATTERN.match(filepath) == None:
+    if SUBMISSION_PATTERN.fullmatch(filepath) is None:
         return "The file does not follow the naming convention for submissions or is located in the wrong directory."
       
-def check_forecast_date(filepath):
+def check_forecast_date(filepath, df):
     try:
         file_forecast_date = pd.to_datetime(os.path.basename(filepath)[:10]).date()
     except:
         return f"Date of filename in wrong format: {os.path.basename(filepath)[:10]}. Should be yyyy-mm-dd."
-    
-    df = pd.read_csv(filepath)    
 
     if df.forecast_date.nunique() > 1:
-        return f"The file contains multiple forecast dates: {df.forecast_date.unique()}. Forecast date must be unique." 
-    
+        return f"The file contains multiple forecast dates: {df.forecast_date.unique()}. Forecast date must be unique."
+
     try:
-        column_forecast_date = pd.to_datetime(df.forecast_date.iloc[0]).date()
+        # forecast_date is already datetime64 as the file is read with parse_dates
+        column_forecast_date = df.forecast_date.iloc[0].date()
     except:
         return f"Date in column \'forecast_date\' in wrong format: {df.forecast_date.iloc[0]}. Should be yyyy-mm-dd."
 
@@ -47,12 +63,14 @@ def check_forecast_date(filepath):
         return f"The forecast is not made today. Date of the forecast: {file_forecast_date}, today: {today}."
 
 def check_column_values(df):
+    quantiles = df['quantile'].dropna()
+
     invalid_values = dict()
-    invalid_values['location'] = [_ for _ in df.location.unique() if _ not in LOCATION_CODES]
-    invalid_values['quantile'] = [_ for _ in df['quantile'].dropna().unique() if _ not in VALID_QUANTILES]
-    invalid_values['type'] = [_ for _ in df.type.unique() if _ not in VALID_TYPES]
-    invalid_values['age_group'] = [_ for _ in df.age_group.unique() if _ not in VALID_AGE_GROUPS]
-    invalid_values['horizon'] = [_ for _ in df.horizon.unique() if _ not in VALID_HORIZONS]
+    invalid_values['location'] = df.loc[~df['location'].isin(_LOCATION_SET), 'location'].unique().tolist()
+    invalid_values['quantile'] = quantiles[~quantiles.isin(_QUANTILE_SET)].unique().tolist()
+    invalid_values['type'] = df.loc[~df['type'].isin(_TYPE_SET), 'type'].unique().tolist()
+    invalid_values['age_group'] = df.loc[~df['age_group'].isin(_AGE_GROUP_SET), 'age_group'].unique().tolist()
+    invalid_values['horizon'] = df.loc[~df['horizon'].isin(_HORIZON_SET), 'horizon'].unique().tolist()
     
     errors = []
     for key, value in invalid_values.items():
@@ -63,8 +81,9 @@ def check_column_values(df):
         return errors
 
 def check_header(df):
-    missing_cols = [c for c in VALID_COLUMNS if c not in df.columns]
-    additional_cols = [c for c in df.columns if c not in VALID_COLUMNS]
+    columns = set(df.columns)
+    missing_cols = [c for c in VALID_COLUMNS if c not in columns]
+    additional_cols = [c for c in df.columns if c not in _VALID_COLUMN_SET]
     
     errors=[]
     
@@ -78,20 +97,24 @@ def check_header(df):
         return errors
 
 def check_target_dates(df):
-    df['invalid_target_date'] = df.apply(lambda x: x.target_end_date != x.forecast_date + 
-                                         pd.Timedelta(weeks = x.horizon, days = -4), axis = 1)
-    
-    invalid_target_dates = df.loc[df.invalid_target_date, ['forecast_date', 'target_end_date', 'horizon']].drop_duplicates()
+    # vectorized over the whole column: target_end_date must be forecast_date + horizon weeks - 4 days
+    expected = df['forecast_date'].values + df['horizon'].values.astype('timedelta64[W]') - np.timedelta64(4, 'D')
+    mask = df['target_end_date'].values != expected
+
+    invalid_target_dates = df.loc[mask, ['forecast_date', 'target_end_date', 'horizon']].drop_duplicates()
     if len(invalid_target_dates) > 0:
-        error = 'The following target_end_dates are wrong:\n\n' + invalid_target_dates.to_string(index = False)
+        error = 'The following target_end_dates are wrong:\n\n' + _preview(invalid_target_dates, index = False)
         return error
 
 def check_value(df):
     errors = []
-    if df.value.isnull().sum():
-        errors.append(f'Missing values in column \'value\' are not allowed. {df.value.isnull().sum()} values are missing.')
-    
-    non_numeric_values = df.value[~df.value.astype(str).str.replace('.', '', regex = False).str.isnumeric()].dropna().to_list()
+    null_count = df['value'].isna().sum()
+    if null_count:
+        errors.append(f'Missing values in column \'value\' are not allowed. {null_count} values are missing.')
+
+    # entries that are non-null but cannot be parsed as numbers
+    coerced = pd.to_numeric(df['value'], errors = 'coerce')
+    non_numeric_values = df['value'][coerced.isna() & df['value'].notna()].to_list()
     if len(non_numeric_values) > 0:
         errors.append(f'Non-numeric entries in column \'value\' are not allowed: {non_numeric_values}.')
     
@@ -99,60 +122,85 @@ def check_value(df):
         return errors
     
 def check_mean(df):
-    n = df[df.type == 'mean']['quantile'].notnull().sum()
-    
+    # boolean masks avoid allocating a filtered copy of all mean rows
+    n = int(((df['type'].values == 'mean') & df['quantile'].notna().values).sum())
+
     if n > 0:
         error = f"Rows with type \"mean\" should have NA in column \'quantile\'. This was violated {n} time{'s' if (n > 1) else ''}."
         return error
     
 def check_duplicates(df):
-    df_duplicated = df[df.duplicated(subset = ['location', 'age_group', 'forecast_date', 'target_end_date', 
-                           'horizon', 'type', 'quantile'], keep = False)].copy()
-    
-    df_duplicated.sort_values(['location', 'age_group', 'forecast_date', 'target_end_date', 
-                           'horizon', 'type', 'quantile'], inplace = True)
-    
-    n = len(df_duplicated)
-    
-    if n > 0:
-        error = f"Duplicated targets present. Check the following {n} rows. \n\n {df_duplicated.to_string()}"
+    key = ['location', 'age_group', 'forecast_date', 'target_end_date',
+           'horizon', 'type', 'quantile']
+
+    # dropna=False keeps mean rows, whose quantile is NaN, in the duplicate check
+    sizes = df.groupby(key, dropna = False)['location'].transform('size')
+    mask = sizes.values > 1
+
+    if mask.any():
+        df_duplicated = df[mask].sort_values(key)
+        n = len(df_duplicated)
+        error = f"Duplicated targets present. Check the following {n} rows. \n\n {_preview(df_duplicated)}"
         return error
 
 def check_quantiles(df):
-    df.loc[df.type != 'mean', 'no_quantiles'] = df[df.type != 'mean'].groupby(['location', 'age_group', 'horizon', 
-                                                                           'target_end_date'])['quantile'].transform('nunique')
-    
+    non_mean = df[df.type != 'mean']
+    grouped = non_mean.groupby(['location', 'age_group', 'horizon', 'target_end_date'])['quantile']
+
     # note that we've already checked that no invalid quantiles are present
-    incomplete_quantiles = df[(df.no_quantiles != 7) & df.no_quantiles.notnull()]
-    
-    only_mean = all(df.type == 'mean')
-    only_median = all(df.loc[df.type == 'quantile', 'quantile'] == 0.5) # currently allows mean and median forecasts
-    
-    if (len(incomplete_quantiles) > 0) and not (only_mean or only_median):
+    no_quantiles = grouped.nunique()
+    bad_keys = no_quantiles.index[no_quantiles != 7]
+
+    only_mean = bool((df['type'].values == 'mean').all())
+    only_median = bool((df['quantile'].values[df['type'].values == 'quantile'] == 0.5).all()) # currently allows mean and median forecasts
+
+    if (len(bad_keys) > 0) and not (only_mean or only_median):
         error = 'Not all quantiles were provided in the following setting(s):\n\n' + \
-            incomplete_quantiles.groupby(['location', 'age_group', 'horizon', 'target_end_date']
-                                        )['quantile'].unique().to_string()
+            _preview(grouped.unique().loc[bad_keys])
         return error
     
 def check_forecast(filepath):
     errors = []
 
+    # read the file only once and share the parsed DataFrame across all checks;
+    # the multi-threaded pyarrow engine is noticeably faster than the default C engine
+    try:
+        df = pd.read_csv(filepath, engine = 'pyarrow', parse_dates = ['forecast_date', 'target_end_date'])
+    except ImportError:
+        df = pd.read_csv(filepath, parse_dates = ['forecast_date', 'target_end_date'])
+    except (ValueError, KeyError):
+        # a date column is missing entirely; read without parse_dates so that
+        # check_header can report which columns are absent
+        df = pd.read_csv(filepath)
+
     result = check_filepath(filepath)
     if result:
         errors.append(result)
-      
-    result = check_forecast_date(filepath)
+
+    # structural tier first: if required columns are missing, the remaining checks
+    # would only raise on the absent columns, so stop here
+    header_errors = check_header(df)
+    if header_errors:
+        errors.extend(header_errors)
+        return errors
+
+    result = check_forecast_date(filepath, df)
     if result:
         errors.extend(result if isinstance(result, list) else [result])
-    
-    df = pd.read_csv(filepath, parse_dates = ['forecast_date', 'target_end_date'])
-    
-    for check in [check_header, check_column_values, check_value, check_mean, check_duplicates, check_target_dates, check_quantiles]:
-        try:
-            result = check(df)
-            if result:
-                errors.extend(result if isinstance(result, list) else [result])
-        except:
-            errors.append(f"Fatal error: {check.__name__} could not be completed.")
+
+    checks = [check_column_values, check_value, check_mean, check_duplicates, check_quantiles]
+    # target dates can only be compared once both date columns parsed as dates and
+    # horizon is numeric; bad forecast_date and horizon entries are reported by
+    # check_forecast_date and check_column_values, bad target_end_dates right here
+    if not pd.api.types.is_datetime64_any_dtype(df['target_end_date']):
+        errors.append("Entries in column \'target_end_date\' could not be parsed as dates. Should be yyyy-mm-dd.")
+    elif pd.api.types.is_datetime64_any_dtype(df['forecast_date']) and \
+            pd.api.types.is_numeric_dtype(df['horizon']):
+        checks.append(check_target_dates)
+
+    for check in checks:
+        result = check(df)
+        if result:
+            errors.extend(result if isinstance(result, list) else [result])
 
     return errors